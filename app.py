@@ -1,8 +1,20 @@
 import os
 import time
+import uuid
 import base64
+import threading
+import contextlib
+import collections
+import ijson
+import redis
+import orjson
 import requests
-from flask import Flask, request, jsonify
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, request, abort
 
 app = Flask(__name__)
 
@@ -16,67 +28,485 @@ XERO_CLIENT_SECRET = os.environ.get("XERO_CLIENT_SECRET")
 if not XERO_CLIENT_ID or not XERO_CLIENT_SECRET:
     print("WARNING: XERO_CLIENT_ID or XERO_CLIENT_SECRET not set")
 
+# Client credentials are fixed for the process, so build these once.
+TOKEN_HEADERS = {
+    "Authorization": "Basic " + base64.b64encode(
+        f"{XERO_CLIENT_ID}:{XERO_CLIENT_SECRET}".encode()
+    ).decode(),
+    "Content-Type": "application/x-www-form-urlencoded",
+}
+
+# (connect, read) timeout for /connect/token. SESSION retries connect
+# errors twice, so a refresh takes at most ~3 * 5 + 20 seconds.
+TOKEN_TIMEOUT = (5, 20)
+
+# Must comfortably outlast the slowest refresh, or a second worker could
+# rotate the same refresh token once the Redis lock expires.
+TOKEN_LOCK_TIMEOUT = 120
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+if not REDIS_URL:
+    print("WARNING: REDIS_URL not set, firms and tokens kept in memory")
+
+# Keep Contacts `where` filters well inside Xero's URL length limit.
+XERO_IDS_PER_CALL = 40
+MAX_QUERY_LEN = 200
+
+# Xero error bodies are echoed back to callers, up to this many characters.
+MAX_ERROR_LEN = 2000
+
+# Same default as gunicorn.conf.py; used to split per-tenant budgets
+# between workers when they can't share them through Redis.
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "2"))
+
+# Xero allows 60 API calls per minute per tenant; stay a little under it.
+# Shared by all workers via Redis, otherwise split evenly between them.
+XERO_CALLS_PER_MINUTE = int(os.environ.get("XERO_CALLS_PER_MINUTE", "55"))
+
+# resolve_bulk fetches XERO_IDS_PER_CALL-sized chunks concurrently, and
+# gives up with a 504 if they haven't all finished after this many seconds.
+MAX_BULK_IDS = 200
+XERO_BULK_TIMEOUT = 60
+
+# Xero allows 5 concurrent calls per tenant; this is each worker's share.
+# Every worker needs at least 1 slot, so with more than 5 workers the
+# total can exceed Xero's limit and some calls may get 429s.
+XERO_MAX_IN_FLIGHT = max(1, 5 // WEB_CONCURRENCY)
+
+if WEB_CONCURRENCY > 5:
+    print("WARNING: WEB_CONCURRENCY > 5, in-flight Xero calls per tenant can exceed 5")
+
+# Background refresh: every REFRESH_INTERVAL seconds, renew cached tokens
+# with less than REFRESH_AHEAD seconds left, off the request path.
+REFRESH_INTERVAL = 30
+REFRESH_AHEAD = 300
+
 # =========================
-# TEMP STORAGE (v1)
+# HTTP SESSION
 # =========================
-# NOTE: This resets on redeploy. OK for now.
+# One pooled session for all outbound calls so connections to
+# identity.xero.com / api.xero.com are kept alive and reused.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    # 429s go back to the caller: retrying them spends more of the
+    # tenant's budget, and Retry-After can be hours on the daily limit.
+    max_retries=Retry(
+        total=2,
+        backoff_factor=0.2,
+        status_forcelist=[500, 502, 503, 504],
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    ),
+))
+SESSION.headers.update({
+    "Accept": "application/json",
+    "Accept-Encoding": "gzip, deflate",
+})
+
+# Shared by handlers that fan out several Xero calls at once. Threads
+# share SESSION's pool (and are greenlets under wsgi.py).
+EXECUTOR = ThreadPoolExecutor(max_workers=16)
+
+# =========================
+# STORAGE
+# =========================
+# With REDIS_URL set, firms and access tokens live in Redis so every
+# worker shares them and they survive redeploys:
+#   firm:<firm_id> -> hash { tenant_id, refresh_token }
+#   tok:<firm_id>  -> access_token (expires at the token's expires_at)
+#   rate:<tenant_id> -> sorted set of Xero API call times (ms), last 60s
+REDIS = redis.Redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+
+# Sliding-window limiter: records a call and returns 0 if the tenant has
+# budget, otherwise returns how many ms until the oldest call ages out.
+# KEYS[1] = rate:<tenant_id>, ARGV = window_ms, limit, unique member
+RATE_SCRIPT = REDIS.register_script("""
+local t = redis.call("TIME")
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local window = tonumber(ARGV[1])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now - window)
+if redis.call("ZCARD", KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call("ZADD", KEYS[1], now, ARGV[3])
+    redis.call("PEXPIRE", KEYS[1], window)
+    return 0
+end
+local oldest = redis.call("ZRANGE", KEYS[1], 0, 0, "WITHSCORES")
+return math.max(1, tonumber(oldest[2]) + window - now)
+""") if REDIS else None
+
+# Fallback without Redis.
+# NOTE: This resets on redeploy and is per-worker. OK for local dev.
 # firm_id -> { tenant_id, refresh_token }
 FIRMS = {}
 
 # firm_id -> { access_token, expires_at }
-ACCESS_CACHE = {}
+# Bounded, and entries older than a token's 30 min lifetime are evicted.
+ACCESS_CACHE = TTLCache(maxsize=100_000, ttl=1800)
+ACCESS_CACHE_LOCK = threading.RLock()
+
+# firm_id -> lock held while rotating that firm's refresh_token
+# (monkey-patched into a gevent lock under wsgi.py)
+LOCKS: dict[str, threading.Lock] = {}
+LOCKS_GUARD = threading.Lock()
+
+# Built responses from Xero Contacts, briefly, since they rarely change.
+# (firm_id, "search", query, limit) -> options
+# (firm_id, "contact", client_id)   -> flattened contact
+CONTACTS_CACHE = TTLCache(maxsize=10_000, ttl=60)
+CONTACTS_CACHE_LOCK = threading.Lock()
+
+# tenant_id -> (lock, monotonic times of Xero API calls in the last minute)
+# Each worker gets 1/WEB_CONCURRENCY of the budget.
+RATE_BUCKETS: dict[str, tuple] = {}
+RATE_BUCKETS_GUARD = threading.Lock()
+WORKER_CALLS_PER_MINUTE = max(1, XERO_CALLS_PER_MINUTE // WEB_CONCURRENCY)
+
+# tenant_id -> semaphore bounding this worker's in-flight Xero calls
+IN_FLIGHT: dict[str, threading.BoundedSemaphore] = {}
+IN_FLIGHT_GUARD = threading.Lock()
 
 # =========================
 # HELPERS
 # =========================
 
-def basic_auth_header():
-    token = f"{XERO_CLIENT_ID}:{XERO_CLIENT_SECRET}"
-    encoded = base64.b64encode(token.encode()).decode()
-    return f"Basic {encoded}"
+def jwt_exp(token: str):
+    """
+    Returns the `exp` claim of a JWT, or None if it can't be read.
+    Signature is not verified; this is only used for cache expiry.
+    """
+    try:
+        part = token.split(".")[1]
+        part += "=" * (-len(part) % 4)
+        return int(orjson.loads(base64.urlsafe_b64decode(part))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+@contextlib.contextmanager
+def firm_lock(firm_id: str):
+    """
+    Lock held while rotating a firm's refresh_token.
+    Shared across workers when Redis is configured.
+    """
+    if REDIS:
+        lock = REDIS.lock(f"lock:{firm_id}", timeout=TOKEN_LOCK_TIMEOUT)
+        lock.acquire()
+        try:
+            yield
+        finally:
+            try:
+                lock.release()
+            except redis.exceptions.LockNotOwnedError:
+                # The work is done and saved; don't turn that into a 500.
+                app.logger.warning("Refresh lock for firm %s expired before release", firm_id)
+        return
+
+    with LOCKS_GUARD:
+        lock = LOCKS.setdefault(firm_id, threading.Lock())
+    with lock:
+        yield
+
+def get_firm(firm_id: str):
+    if REDIS:
+        return REDIS.hgetall(f"firm:{firm_id}") or None
+    return FIRMS.get(firm_id)
+
+def save_firm(firm_id: str, tenant_id: str, refresh_token: str):
+    firm = {"tenant_id": tenant_id, "refresh_token": refresh_token}
+    if REDIS:
+        REDIS.hset(f"firm:{firm_id}", mapping=firm)
+    else:
+        FIRMS[firm_id] = firm
+
+def set_refresh_token(firm_id: str, refresh_token: str):
+    """
+    Call only while holding firm_lock(firm_id), which makes this the sole
+    writer. Readers see either the old or the new firm, never a mix.
+    """
+    if REDIS:
+        REDIS.hset(f"firm:{firm_id}", "refresh_token", refresh_token)
+    else:
+        firm = dict(FIRMS[firm_id])
+        firm["refresh_token"] = refresh_token
+        FIRMS[firm_id] = firm
+
+def firm_ids() -> list:
+    if REDIS:
+        return [key.split(":", 1)[1] for key in REDIS.scan_iter("firm:*")]
+    return list(FIRMS.keys())
+
+def token_ttl(firm_id: str):
+    """
+    Seconds until the firm's cached access token expires, or None if
+    there is no cached token.
+    """
+    if REDIS:
+        ttl = REDIS.ttl(f"tok:{firm_id}")
+        return ttl if ttl >= 0 else None
+    with ACCESS_CACHE_LOCK:
+        cached = ACCESS_CACHE.get(firm_id)
+    if not cached:
+        return None
+    return cached["expires_at"] - int(time.time())
+
+def get_cached_token(firm_id: str, min_ttl: int = 0):
+    """
+    Returns the cached access token if it has more than min_ttl seconds left.
+    """
+    if REDIS:
+        pipe = REDIS.pipeline(transaction=False)
+        pipe.get(f"tok:{firm_id}")
+        pipe.ttl(f"tok:{firm_id}")
+        token, ttl = pipe.execute()
+        return token if token and ttl > min_ttl else None
+    with ACCESS_CACHE_LOCK:
+        cached = ACCESS_CACHE.get(firm_id)
+    if cached and cached["expires_at"] > int(time.time()) + min_ttl:
+        return cached["access_token"]
+    return None
+
+def cache_token(firm_id: str, access_token: str, expires_at: int):
+    if REDIS:
+        REDIS.set(f"tok:{firm_id}", access_token, exat=expires_at)
+    else:
+        with ACCESS_CACHE_LOCK:
+            ACCESS_CACHE[firm_id] = {
+                "access_token": access_token,
+                "expires_at": expires_at,
+            }
+
+def drop_cached_token(firm_id: str):
+    if REDIS:
+        REDIS.delete(f"tok:{firm_id}")
+    else:
+        with ACCESS_CACHE_LOCK:
+            ACCESS_CACHE.pop(firm_id, None)
+
+def refresh_access_token(firm_id: str, min_ttl: int = 0) -> str:
+    """
+    Ensures a valid access token for the firm, with more than min_ttl
+    seconds left. Automatically refreshes and rotates refresh_token.
+    """
+    cached = get_cached_token(firm_id, min_ttl)
+    if cached:
+        return cached
+
+    # Refresh tokens rotate on every use, so two concurrent refreshes for
+    # the same firm would invalidate one another. Only one at a time.
+    with firm_lock(firm_id):
+        cached = get_cached_token(firm_id, min_ttl)
+        if cached:
+            return cached
+
+        now = int(time.time())
+
+        firm = get_firm(firm_id)
+        if not firm:
+            raise Exception("Firm not connected")
+
+        resp = SESSION.post(
+            "https://identity.xero.com/connect/token",
+            headers=TOKEN_HEADERS,
+            data={
+                "grant_type": "refresh_token",
+                "refresh_token": firm["refresh_token"],
+            },
+            timeout=TOKEN_TIMEOUT,
+        )
+
+        if resp.status_code != 200:
+            raise Exception(f"Token refresh failed: {error_text(resp)}")
+
+        data = orjson.loads(resp.content)
+        access_token = data["access_token"]
+
+        # Trust the JWT's own `exp` over `expires_in` (which ignores transit
+        # time), and keep a 60s buffer so we never hand out a dying token.
+        expires_at = now + int(data.get("expires_in", 1800))
+        exp = jwt_exp(access_token)
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        expires_at -= 60
+
+        app.logger.debug("Access token for firm %s cached for %ss", firm_id, expires_at - now)
+
+        # IMPORTANT: refresh tokens rotate. Persist the new one first; the
+        # old one is already spent.
+        set_refresh_token(firm_id, data["refresh_token"])
+
+        cache_token(firm_id, access_token, expires_at)
+
+        return access_token
+
+def acquire_rate(tenant_id: str, deadline: float = None):
+    """
+    Blocks until the tenant has budget for another Xero API call, so bursts
+    queue here instead of coming back as 429s. Call it from the request's
+    own thread, never from EXECUTOR, so a throttled tenant can't tie up
+    the shared pool. Raises FutureTimeout rather than wait past `deadline`
+    (a time.monotonic() value).
+    """
+    if REDIS:
+        member = uuid.uuid4().hex
+        while True:
+            wait_ms = RATE_SCRIPT(keys=[f"rate:{tenant_id}"], args=[60_000, XERO_CALLS_PER_MINUTE, member])
+            if not wait_ms:
+                return
+            if deadline is not None and time.monotonic() + wait_ms / 1000 > deadline:
+                raise FutureTimeout()
+            time.sleep(wait_ms / 1000)
+
+    with RATE_BUCKETS_GUARD:
+        lock, calls = RATE_BUCKETS.setdefault(tenant_id, (threading.Lock(), collections.deque()))
+
+    with lock:
+        now = time.monotonic()
+        while calls and calls[0] <= now - 60:
+            calls.popleft()
+
+        if len(calls) >= WORKER_CALLS_PER_MINUTE:
+            if deadline is not None and calls[0] + 60 > deadline:
+                raise FutureTimeout()
+            time.sleep(calls[0] + 60 - now)
+            calls.popleft()
+            now = time.monotonic()
+
+        calls.append(now)
+
+def tenant_slots(tenant_id: str) -> threading.BoundedSemaphore:
+    with IN_FLIGHT_GUARD:
+        return IN_FLIGHT.setdefault(tenant_id, threading.BoundedSemaphore(XERO_MAX_IN_FLIGHT))
+
+def xero_get(tenant_id: str, url: str, **kwargs) -> requests.Response:
+    acquire_rate(tenant_id)
+    with tenant_slots(tenant_id):
+        return SESSION.get(url, **kwargs)
+
+def xero_submit(tenant_id: str, deadline: float, url: str, **kwargs):
+    """
+    Like xero_get, but runs the call on EXECUTOR and returns a Future.
+    Waits for rate budget and an in-flight slot in the caller's thread,
+    so pool workers only ever run the HTTP call itself. Raises
+    FutureTimeout if either isn't available before `deadline`.
+    """
+    acquire_rate(tenant_id, deadline)
+    slots = tenant_slots(tenant_id)
+    if not slots.acquire(timeout=max(0, deadline - time.monotonic())):
+        raise FutureTimeout()
+    future = EXECUTOR.submit(SESSION.get, url, **kwargs)
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+def normalize_guid(value):
+    """
+    Canonical lowercase form of a GUID, or None if it isn't one. Used for
+    ContactIDs so cache keys match however the caller formats them.
+    """
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
 
-def refresh_access_token(firm_id: str) -> str:
+def xero_escape(s: str) -> str:
     """
-    Ensures a valid access token for the firm.
-    Automatically refreshes and rotates refresh_token.
+    Escapes a value for use inside a double-quoted `where` string.
     """
-    now = int(time.time())
+    return s.replace("\\", "\\\\").replace('"', '\\"')
 
-    cached = ACCESS_CACHE.get(firm_id)
-    if cached and cached["expires_at"] > now + 60:
-        return cached["access_token"]
+def jsonr(obj, code: int = 200):
+    return app.response_class(orjson.dumps(obj), status=code, mimetype="application/json")
 
-    firm = FIRMS.get(firm_id)
-    if not firm:
-        raise Exception("Firm not connected")
+def error_text(resp: requests.Response) -> str:
+    # Xero sends UTF-8; skip the charset detection resp.text would do.
+    return resp.content.decode("utf-8", "replace")[:MAX_ERROR_LEN]
 
-    resp = requests.post(
-        "https://identity.xero.com/connect/token",
-        headers={
-            "Authorization": basic_auth_header(),
-            "Content-Type": "application/x-www-form-urlencoded",
-        },
-        data={
-            "grant_type": "refresh_token",
-            "refresh_token": firm["refresh_token"],
-        },
-        timeout=30,
-    )
+def xero_error(resp: requests.Response):
+    return jsonr({"ok": False, "error": error_text(resp)}, resp.status_code)
 
-    if resp.status_code != 200:
-        raise Exception(f"Token refresh failed: {resp.text}")
+def read_json() -> dict:
+    """
+    Parses the request body as a JSON object regardless of Content-Type.
+    Anything else aborts with the usual {"ok": False, ...} 400.
+    """
+    body = request.get_data()
+    if not body:
+        return {}
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        abort(jsonr({"ok": False, "error": "invalid JSON body"}, 400))
+    if payload is None:
+        return {}
+    if not isinstance(payload, dict):
+        abort(jsonr({"ok": False, "error": "JSON body must be an object"}, 400))
+    return payload
+
+def contacts_cache_get(key: tuple):
+    with CONTACTS_CACHE_LOCK:
+        return CONTACTS_CACHE.get(key)
+
+def contacts_cache_set(key: tuple, value):
+    with CONTACTS_CACHE_LOCK:
+        CONTACTS_CACHE[key] = value
+
+def forget_firm(firm_id: str):
+    """
+    Drops the firm's access token and cached contacts, e.g. after Xero
+    rejects the token or the firm reconnects.
+    """
+    drop_cached_token(firm_id)
+    with CONTACTS_CACHE_LOCK:
+        for key in [k for k in CONTACTS_CACHE if k[0] == firm_id]:
+            CONTACTS_CACHE.pop(key, None)
 
-    data = resp.json()
+# Stand-in for a missing Addresses/Phones list. Shared, so never mutate it.
+NO_ITEMS = ({},)
 
-    ACCESS_CACHE[firm_id] = {
-        "access_token": data["access_token"],
-        "expires_at": now + int(data.get("expires_in", 1800)),
+def flatten_contact(c: dict) -> dict:
+    address = (c.get("Addresses") or NO_ITEMS)[0]
+
+    return {
+        "client_id": c.get("ContactID"),
+        "full_name": c.get("Name"),
+        "email": c.get("EmailAddress"),
+        "phone": (c.get("Phones") or NO_ITEMS)[0].get("PhoneNumber"),
+        "address_line1": address.get("AddressLine1"),
+        "city": address.get("City"),
+        "state": address.get("Region"),
+        "postcode": address.get("PostalCode"),
+        "country": address.get("Country"),
     }
 
-    # IMPORTANT: refresh tokens rotate
-    firm["refresh_token"] = data["refresh_token"]
+# =========================
+# BACKGROUND REFRESH
+# =========================
 
-    return data["access_token"]
+def refresh_loop():
+    """
+    Renews tokens that are about to expire so requests rarely wait on
+    /connect/token. Firms without a cached token are left to refresh on
+    their next request.
+    """
+    while True:
+        time.sleep(REFRESH_INTERVAL)
+        for firm_id in firm_ids():
+            try:
+                ttl = token_ttl(firm_id)
+                if ttl is not None and ttl < REFRESH_AHEAD:
+                    refresh_access_token(firm_id, min_ttl=REFRESH_AHEAD)
+            except Exception:
+                app.logger.exception("Background token refresh failed for firm %s", firm_id)
+
+def start_refresh_loop():
+    """
+    Starts refresh_loop in a daemon thread (a greenlet under wsgi.py).
+    Called per server process, from gunicorn's post_worker_init hook or
+    __main__, never on import: any process running it rotates live
+    refresh tokens. firm_lock keeps workers from refreshing a firm twice.
+    """
+    threading.Thread(target=refresh_loop, name="token-refresh", daemon=True).start()
 
 # =========================
 # ROUTES
@@ -91,131 +521,247 @@ def firms_connect():
     """
     One-time bootstrap per firm.
     """
-    payload = request.get_json(force=True) or {}
+    payload = read_json()
 
     firm_id = payload.get("firm_id")
     tenant_id = payload.get("tenant_id")
     refresh_token = payload.get("refresh_token")
 
     if not firm_id or not tenant_id or not refresh_token:
-        return jsonify({
+        return jsonr({
             "ok": False,
             "error": "firm_id, tenant_id, refresh_token required"
-        }), 400
+        }, 400)
 
-    FIRMS[firm_id] = {
-        "tenant_id": tenant_id,
-        "refresh_token": refresh_token,
-    }
+    with firm_lock(firm_id):
+        save_firm(firm_id, tenant_id, refresh_token)
+        forget_firm(firm_id)
 
-    ACCESS_CACHE.pop(firm_id, None)
-
-    return jsonify({
+    return jsonr({
         "ok": True,
         "firm_id": firm_id
-    }), 200
+    }, 200)
 
 @app.post("/clients/search")
 def clients_search():
-    payload = request.get_json(force=True) or {}
+    payload = read_json()
 
     firm_id = payload.get("firm_id")
     query = (payload.get("query") or "").strip()
     limit = int(payload.get("limit") or 5)
 
     if not firm_id or not query:
-        return jsonify({
+        return jsonr({
             "ok": False,
             "error": "firm_id and query required"
-        }), 400
+        }, 400)
+
+    if len(query) > MAX_QUERY_LEN:
+        return jsonr({
+            "ok": False,
+            "error": f"query must be at most {MAX_QUERY_LEN} characters"
+        }, 400)
 
-    firm = FIRMS.get(firm_id)
+    firm = get_firm(firm_id)
     if not firm:
-        return jsonify({"ok": False, "error": "firm not connected"}), 400
+        return jsonr({"ok": False, "error": "firm not connected"}, 400)
+
+    cache_key = (firm_id, "search", query.lower(), limit)
+    options = contacts_cache_get(cache_key)
+    if options is not None:
+        return jsonr({"ok": True, "options": options}, 200)
 
     access_token = refresh_access_token(firm_id)
 
-    where = f'Name.Contains("{query}")'
+    where = f'Name.Contains("{xero_escape(query)}")'
 
-    resp = requests.get(
+    # page=1 caps Xero at 100 contacts instead of every match.
+    resp = xero_get(
+        firm["tenant_id"],
         "https://api.xero.com/api.xro/2.0/Contacts",
         headers={
             "Authorization": f"Bearer {access_token}",
             "xero-tenant-id": firm["tenant_id"],
-            "Accept": "application/json",
         },
-        params={"where": where},
+        params={"where": where, "page": 1},
         timeout=30,
+        stream=True,
     )
 
-    if resp.status_code != 200:
-        return jsonify({"ok": False, "error": resp.text}), resp.status_code
-
-    contacts = resp.json().get("Contacts", [])[:limit]
-
-    options = []
-    for c in contacts:
-        cid = c.get("ContactID")
-        name = c.get("Name")
-        email = c.get("EmailAddress") or ""
-        if cid and name:
-            label = f"{name} — {email}".strip(" —")
-            options.append({"id": cid, "label": label})
-
-    return jsonify({"ok": True, "options": options}), 200
+    try:
+        if resp.status_code == 401:
+            forget_firm(firm_id)
+
+        if resp.status_code != 200:
+            return xero_error(resp)
+
+        # Parse contacts one at a time and stop once we have enough.
+        resp.raw.decode_content = True
+        options = []
+        for c in ijson.items(resp.raw, "Contacts.item"):
+            cid = c.get("ContactID")
+            name = c.get("Name")
+            email = c.get("EmailAddress") or ""
+            if cid and name:
+                label = f"{name} — {email}".strip(" —")
+                options.append({"id": cid, "label": label})
+                if len(options) >= limit:
+                    break
+    finally:
+        # Drain what we didn't parse so the connection goes back to the pool.
+        resp.raw.drain_conn()
+        resp.close()
+
+    contacts_cache_set(cache_key, options)
+
+    return jsonr({"ok": True, "options": options}, 200)
 
 @app.post("/clients/resolve")
 def clients_resolve():
-    payload = request.get_json(force=True) or {}
+    payload = read_json()
 
     firm_id = payload.get("firm_id")
     client_id = payload.get("client_id")
 
     if not firm_id or not client_id:
-        return jsonify({
+        return jsonr({
             "ok": False,
             "error": "firm_id and client_id required"
-        }), 400
+        }, 400)
+
+    # Xero also accepts a ContactNumber here, so only GUIDs are normalized
+    # (to share cache entries with resolve_bulk); anything else passes through.
+    client_id = normalize_guid(client_id) or str(client_id)
 
-    firm = FIRMS.get(firm_id)
+    firm = get_firm(firm_id)
     if not firm:
-        return jsonify({"ok": False, "error": "firm not connected"}), 400
+        return jsonr({"ok": False, "error": "firm not connected"}, 400)
+
+    cache_key = (firm_id, "contact", client_id)
+    client = contacts_cache_get(cache_key)
+    if client is not None:
+        return jsonr({"ok": True, **client}, 200)
 
     access_token = refresh_access_token(firm_id)
 
-    resp = requests.get(
-        f"https://api.xero.com/api.xro/2.0/Contacts/{client_id}",
+    resp = xero_get(
+        firm["tenant_id"],
+        f"https://api.xero.com/api.xro/2.0/Contacts/{quote(client_id, safe='')}",
         headers={
             "Authorization": f"Bearer {access_token}",
             "xero-tenant-id": firm["tenant_id"],
-            "Accept": "application/json",
         },
         timeout=30,
     )
 
+    if resp.status_code == 401:
+        forget_firm(firm_id)
+
     if resp.status_code != 200:
-        return jsonify({"ok": False, "error": resp.text}), resp.status_code
+        return xero_error(resp)
+
+    c = (orjson.loads(resp.content).get("Contacts") or [{}])[0]
 
-    c = (resp.json().get("Contacts") or [{}])[0]
+    client = flatten_contact(c)
+    contacts_cache_set(cache_key, client)
 
-    address = (c.get("Addresses") or [{}])[0]
+    return jsonr({"ok": True, **client}, 200)
 
-    return jsonify({
+@app.post("/clients/resolve_bulk")
+def clients_resolve_bulk():
+    """
+    Resolves up to MAX_BULK_IDS clients, XERO_IDS_PER_CALL per Xero
+    call, with the calls made concurrently. Clients come back in request
+    order; IDs Xero doesn't know are listed under "missing".
+    """
+    payload = read_json()
+
+    firm_id = payload.get("firm_id")
+    client_ids = payload.get("client_id")
+
+    if not firm_id or not client_ids or not isinstance(client_ids, list):
+        return jsonr({
+            "ok": False,
+            "error": "firm_id and client_id list required"
+        }, 400)
+
+    if len(client_ids) > MAX_BULK_IDS:
+        return jsonr({
+            "ok": False,
+            "error": f"at most {MAX_BULK_IDS} client_id values per request"
+        }, 400)
+
+    # ContactIDs are GUIDs; anything else would be injected into `where`.
+    client_ids = [normalize_guid(cid) for cid in client_ids]
+    if None in client_ids:
+        return jsonr({"ok": False, "error": "client_id must be GUIDs"}, 400)
+    client_ids = list(dict.fromkeys(client_ids))
+
+    firm = get_firm(firm_id)
+    if not firm:
+        return jsonr({"ok": False, "error": "firm not connected"}, 400)
+
+    found = {}
+    uncached = []
+    for cid in client_ids:
+        client = contacts_cache_get((firm_id, "contact", cid))
+        if client is not None:
+            found[cid] = client
+        else:
+            uncached.append(cid)
+
+    if uncached:
+        access_token = refresh_access_token(firm_id)
+
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "xero-tenant-id": firm["tenant_id"],
+        }
+
+        deadline = time.monotonic() + XERO_BULK_TIMEOUT
+        try:
+            futures = []
+            for i in range(0, len(uncached), XERO_IDS_PER_CALL):
+                chunk = uncached[i:i + XERO_IDS_PER_CALL]
+                where = " OR ".join(f'ContactID=guid("{cid}")' for cid in chunk)
+                futures.append(xero_submit(
+                    firm["tenant_id"],
+                    deadline,
+                    "https://api.xero.com/api.xro/2.0/Contacts",
+                    headers=headers,
+                    params={"where": where},
+                    timeout=30,
+                ))
+
+            responses = [f.result(timeout=max(0, deadline - time.monotonic())) for f in futures]
+        except FutureTimeout:
+            return jsonr({"ok": False, "error": "timed out waiting for Xero"}, 504)
+
+        for resp in responses:
+            if resp.status_code == 401:
+                forget_firm(firm_id)
+
+            if resp.status_code != 200:
+                return xero_error(resp)
+
+        for resp in responses:
+            for c in orjson.loads(resp.content).get("Contacts", []):
+                client = flatten_contact(c)
+                cid = normalize_guid(client["client_id"])
+                if cid:
+                    contacts_cache_set((firm_id, "contact", cid), client)
+                    found[cid] = client
+
+    return jsonr({
         "ok": True,
-        "client_id": c.get("ContactID"),
-        "full_name": c.get("Name"),
-        "email": c.get("EmailAddress"),
-        "phone": (c.get("Phones") or [{}])[0].get("PhoneNumber"),
-        "address_line1": address.get("AddressLine1"),
-        "city": address.get("City"),
-        "state": address.get("Region"),
-        "postcode": address.get("PostalCode"),
-        "country": address.get("Country"),
-    }), 200
+        "clients": [found[cid] for cid in client_ids if cid in found],
+        "missing": [cid for cid in client_ids if cid not in found],
+    }, 200)
 
 # =========================
 # ENTRYPOINT (local only)
 # =========================
 
 if __name__ == "__main__":
+    start_refresh_loop()
     app.run(host="0.0.0.0", port=10000)
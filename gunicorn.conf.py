@@ -0,0 +1,19 @@
+import os
+
+# =========================
+# GUNICORN CONFIG
+# =========================
+# Handlers spend almost all their time waiting on Xero, so run gevent
+# workers: monkey-patched sockets yield on I/O and one worker can serve
+# hundreds of requests at once. Keep handlers plain `def` under gevent.
+# Start with: gunicorn wsgi:app
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "gevent"
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "500"))
+timeout = 60
+
+def post_worker_init(worker):
+    from app import start_refresh_loop
+    start_refresh_loop()
@@ -0,0 +1,127 @@
+import os
+import gzip
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import orjson
+import pytest
+
+os.environ.pop("REDIS_URL", None)
+
+import app  # noqa: E402
+
+
+def contacts_body(n: int) -> bytes:
+    # Random hex keeps the gzipped body large; Xero pages are similar.
+    return orjson.dumps({"Contacts": [
+        {
+            "ContactID": f"00000000-0000-0000-0000-{i:012d}",
+            "Name": f"Smith {os.urandom(16).hex()}",
+            "EmailAddress": f"{os.urandom(16).hex()}@example.com",
+        }
+        for i in range(n)
+    ]})
+
+
+@pytest.fixture
+def xero(monkeypatch):
+    """
+    Local stand-in for api.xero.com serving a gzipped Contacts page.
+    """
+    body = gzip.compress(contacts_body(2000))
+    paths = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            paths.append(self.path)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    get = app.SESSION.get
+    monkeypatch.setattr(app.SESSION, "get", lambda url, **kw: get(url.replace("https://api.xero.com", base), **kw))
+
+    app.save_firm("firm-1", "tenant-1", "refresh")
+    app.cache_token("firm-1", "access", int(time.time()) + 3600)
+
+    yield body, paths
+
+    server.shutdown()
+    app.FIRMS.pop("firm-1", None)
+    app.forget_firm("firm-1")
+
+
+def test_search_stops_early_on_large_gzip_body(xero):
+    body, _ = xero
+    assert len(body) > 64 * 1024
+
+    resp = app.app.test_client().post("/clients/search", json={
+        "firm_id": "firm-1",
+        "query": "Smith",
+        "limit": 2,
+    })
+
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body["ok"] is True
+    assert [o["id"] for o in body["options"]] == [
+        "00000000-0000-0000-0000-000000000000",
+        "00000000-0000-0000-0000-000000000001",
+    ]
+
+
+def test_resolve_passes_contact_numbers_through(xero):
+    _, paths = xero
+
+    resp = app.app.test_client().post("/clients/resolve", json={
+        "firm_id": "firm-1",
+        "client_id": "CN 12/3",
+    })
+
+    assert resp.status_code == 200
+    assert paths == ["/api.xro/2.0/Contacts/CN%2012%2F3"]
+
+
+def test_resolve_normalizes_guids(xero):
+    _, paths = xero
+
+    resp = app.app.test_client().post("/clients/resolve", json={
+        "firm_id": "firm-1",
+        "client_id": "{00000000-0000-0000-0000-00000000000A}",
+    })
+
+    assert resp.status_code == 200
+    assert paths == ["/api.xro/2.0/Contacts/00000000-0000-0000-0000-00000000000a"]
+
+
+def test_resolve_bulk_times_out_when_tenant_is_busy(xero, monkeypatch):
+    monkeypatch.setattr(app, "XERO_BULK_TIMEOUT", 0.2)
+    slots = app.tenant_slots("tenant-1")
+    for _ in range(app.XERO_MAX_IN_FLIGHT):
+        slots.acquire()
+
+    try:
+        started = time.monotonic()
+        resp = app.app.test_client().post("/clients/resolve_bulk", json={
+            "firm_id": "firm-1",
+            "client_id": ["00000000-0000-0000-0000-000000000001"],
+        })
+    finally:
+        for _ in range(app.XERO_MAX_IN_FLIGHT):
+            slots.release()
+
+    assert resp.status_code == 504
+    assert time.monotonic() - started < 2
@@ -0,0 +1,5 @@
+# Patch before anything imports socket/ssl (requests, urllib3, the app).
+from gevent import monkey
+monkey.patch_all()
+
+from app import app  # noqa: E402